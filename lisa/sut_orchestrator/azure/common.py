@@ -3,8 +3,9 @@
 
 import re
 import sys
-from dataclasses import InitVar, dataclass, field
+from dataclasses import InitVar, dataclass, field, fields
 from datetime import datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
 from threading import Lock
 from time import sleep
@@ -69,6 +70,20 @@ if TYPE_CHECKING:
 
 AZURE_SHARED_RG_NAME = "lisa_shared_resource"
 
+# separators of marketplace and shared gallery strings, compiled once since the
+# image properties are read on every node deployment.
+_MARKETPLACE_SPLIT_PATTERN = re.compile(r"[:\s]+")
+_SHARED_GALLERY_SPLIT_PATTERN = re.compile(r"[/]+")
+
+
+def _normalize_image_str(value: str) -> str:
+    # values are usually lower case already, check it first to skip the copy
+    # made by lower().
+    value = value.strip()
+    if value.islower() and value.isascii():
+        return value
+    return value.lower()
+
 
 # when call sdk APIs, it's easy to have conflict on access auth files. Use lock
 # to prevent it happens.
@@ -110,6 +125,22 @@ class AzureVmMarketplaceSchema:
         return hash(f"{self.publisher}/{self.offer}/{self.sku}/{self.version}")
 
 
+# all fields of AzureVmMarketplaceSchema are plain strings, so it's constructed
+# directly instead of a round trip through marshmallow.
+_MARKETPLACE_FIELDS = frozenset(f.name for f in fields(AzureVmMarketplaceSchema))
+
+
+def _marketplace_to_dict(marketplace: AzureVmMarketplaceSchema) -> Dict[str, str]:
+    # the same literal keeps key order, and it's cheaper than asdict(), which
+    # deep copies each value.
+    return {
+        "publisher": marketplace.publisher,
+        "offer": marketplace.offer,
+        "sku": marketplace.sku,
+        "version": marketplace.version,
+    }
+
+
 @dataclass_json()
 @dataclass
 class SharedImageGallerySchema:
@@ -184,25 +215,27 @@ class AzureNodeSchema:
 
     @property
     def marketplace(self) -> Optional[AzureVmMarketplaceSchema]:
-        # this is a safe guard and prevent mypy error on typing
-        if not hasattr(self, "_marketplace"):
-            self._marketplace: Optional[AzureVmMarketplaceSchema] = None
-        marketplace: Optional[AzureVmMarketplaceSchema] = self._marketplace
-        if not marketplace:
+        # the parsed result is cached until it's replaced by the setter.
+        marketplace: Optional[AzureVmMarketplaceSchema] = self.__dict__.get(
+            "_marketplace"
+        )
+        if marketplace is None:
             if isinstance(self.marketplace_raw, dict):
                 # Users decide the cases of image names,
                 #  the inconsistent cases cause the mismatched error in notifiers.
                 # The lower() normalizes the image names,
                 #  it has no impact on deployment.
-                self.marketplace_raw = dict(
-                    (k, v.lower()) for k, v in self.marketplace_raw.items()
-                )
-                marketplace = schema.load_by_type(
-                    AzureVmMarketplaceSchema, self.marketplace_raw
-                )
-                # this step makes marketplace_raw is validated, and
-                # filter out any unwanted content.
-                self.marketplace_raw = marketplace.to_dict()  # type: ignore
+                unknown_fields = set(self.marketplace_raw) - _MARKETPLACE_FIELDS
+                if unknown_fields:
+                    raise LisaException(
+                        f"unknown fields in marketplace: {sorted(unknown_fields)}"
+                    )
+                self.marketplace_raw = {
+                    k: _normalize_image_str(v) for k, v in self.marketplace_raw.items()
+                }
+                marketplace = AzureVmMarketplaceSchema(**self.marketplace_raw)
+                # this step fills the default values of missing fields.
+                self.marketplace_raw = _marketplace_to_dict(marketplace)
             elif self.marketplace_raw:
                 assert isinstance(
                     self.marketplace_raw, str
@@ -215,14 +248,22 @@ class AzureNodeSchema:
                     #  the inconsistent cases cause the mismatched error in notifiers.
                     # The lower() normalizes the image names,
                     #  it has no impact on deployment.
-                    marketplace_strings = re.split(
-                        r"[:\s]+", self.marketplace_raw.lower()
+                    marketplace_strings = _MARKETPLACE_SPLIT_PATTERN.split(
+                        _normalize_image_str(self.marketplace_raw)
                     )
 
                     if len(marketplace_strings) == 4:
-                        marketplace = AzureVmMarketplaceSchema(*marketplace_strings)
-                        # marketplace_raw is used
-                        self.marketplace_raw = marketplace.to_dict()  # type: ignore
+                        publisher, offer, sku, version = marketplace_strings
+                        marketplace = AzureVmMarketplaceSchema(
+                            publisher, offer, sku, version
+                        )
+                        # marketplace_raw is used, build it from the parsed parts.
+                        self.marketplace_raw = {
+                            "publisher": publisher,
+                            "offer": offer,
+                            "sku": sku,
+                            "version": version,
+                        }
                     else:
                         raise LisaException(
                             f"Invalid value for the provided marketplace "
@@ -231,7 +272,7 @@ class AzureNodeSchema:
                             f"'<Publisher> <Offer> <Sku> <Version>' "
                             f"or '<Publisher>:<Offer>:<Sku>:<Version>'"
                         )
-            self._marketplace = marketplace
+            self._marketplace: Optional[AzureVmMarketplaceSchema] = marketplace
         return marketplace
 
     @marketplace.setter
@@ -240,7 +281,7 @@ class AzureNodeSchema:
         if value is None:
             self.marketplace_raw = None
         else:
-            self.marketplace_raw = value.to_dict()  # type: ignore
+            self.marketplace_raw = _marketplace_to_dict(value)
 
     @property
     def shared_gallery(self) -> Optional[SharedImageGallerySchema]:
@@ -255,9 +296,9 @@ class AzureNodeSchema:
             #  the inconsistent cases cause the mismatched error in notifiers.
             # The lower() normalizes the image names,
             #  it has no impact on deployment.
-            self.shared_gallery_raw = dict(
-                (k, v.lower()) for k, v in self.shared_gallery_raw.items()
-            )
+            self.shared_gallery_raw = {
+                k: _normalize_image_str(v) for k, v in self.shared_gallery_raw.items()
+            }
             shared_gallery = schema.load_by_type(
                 SharedImageGallerySchema, self.shared_gallery_raw
             )
@@ -274,8 +315,8 @@ class AzureNodeSchema:
             #  the inconsistent cases cause the mismatched error in notifiers.
             # The lower() normalizes the image names,
             #  it has no impact on deployment.
-            shared_gallery_strings = re.split(
-                r"[/]+", self.shared_gallery_raw.strip().lower()
+            shared_gallery_strings = _SHARED_GALLERY_SPLIT_PATTERN.split(
+                _normalize_image_str(self.shared_gallery_raw)
             )
             if len(shared_gallery_strings) == 5:
                 shared_gallery = SharedImageGallerySchema(*shared_gallery_strings)
@@ -316,7 +357,7 @@ class AzureNodeSchema:
                 self.shared_gallery_raw, dict
             ), f"actual type: {type(self.shared_gallery_raw)}"
             if self.shared_gallery.resource_group_name:
-                result = "/".join([x for x in self.shared_gallery_raw.values()])
+                result = "/".join(self.shared_gallery_raw.values())
             else:
                 result = (
                     f"{self.shared_gallery.image_gallery}/"
@@ -327,7 +368,7 @@ class AzureNodeSchema:
             assert isinstance(
                 self.marketplace_raw, dict
             ), f"actual type: {type(self.marketplace_raw)}"
-            result = " ".join([x for x in self.marketplace_raw.values()])
+            result = " ".join(self.marketplace_raw.values())
         return result
 
 
@@ -427,6 +468,9 @@ class AzureArmParameter:
         add_secret(self.admin_key_data)
 
 
+# SDK clients set up their pipelines and policies on creation, and they are
+# thread safe, so they are cached and shared by the operations of a platform.
+@lru_cache(maxsize=10)
 def get_compute_client(
     platform: "AzurePlatform",
     api_version: Optional[str] = None,
@@ -726,6 +770,7 @@ def get_virtual_networks(
     return virtual_network_dict
 
 
+@lru_cache(maxsize=10)
 def get_network_client(platform: "AzurePlatform") -> ComputeManagementClient:
     return NetworkManagementClient(
         credential=platform.credential,
@@ -733,6 +778,7 @@ def get_network_client(platform: "AzurePlatform") -> ComputeManagementClient:
     )
 
 
+@lru_cache(maxsize=10)
 def get_storage_client(
     credential: Any, subscription_id: str
 ) -> StorageManagementClient:
@@ -750,14 +796,16 @@ def get_resource_management_client(
     )
 
 
+@lru_cache(maxsize=256)
 def get_storage_account_name(
     subscription_id: str, location: str, type: str = "s"
 ) -> str:
     subscription_id_postfix = subscription_id[-8:]
     # name should be shorter than 24 character
-    return f"lisa{type}{location[0:11]}{subscription_id_postfix}"
+    return f"lisa{type}{location[:11]}{subscription_id_postfix}"
 
 
+@lru_cache(maxsize=10)
 def get_marketplace_ordering_client(
     platform: "AzurePlatform",
 ) -> MarketplaceOrderingAgreements:
@@ -1,9 +1,11 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT license.
 
+import builtins
 import pathlib
 import re
-from typing import List
+from functools import lru_cache
+from typing import Any, List, Optional, Pattern, Set, Union
 
 from assertpy import assert_that
 from semver import VersionInfo
@@ -17,6 +19,12 @@ class CodeExistsException(LisaException):
     ...
 
 
+@lru_cache(maxsize=128)
+def _compile_tag_filter(pattern: str) -> Pattern[str]:
+    # callers often poll get_tag with the same filter, compile it once.
+    return re.compile(pattern)
+
+
 class Git(Tool):
     CODE_FOLDER_PATTERN = re.compile(r"Cloning into '(.+)'")
     CODE_FOLDER_ON_EXISTS_PATTERN = re.compile(
@@ -27,7 +35,18 @@ class Git(Tool):
     CERTIFICATE_ISSUE_PATTERN = re.compile(
         r"server certificate verification failed", re.M
     )
-    VERSION_PATTERN = re.compile(r"[0-9]+\.[0-9]+\.[0-9]+")
+    # git version 2.34.1
+    VERSION_PATTERN = re.compile(
+        r"(?P<major>[0-9]+)\.(?P<minor>[0-9]+)\.(?P<patch>[0-9]+)"
+    )
+    # git tag sort was not added until 2.36.1 in 2015
+    # https://github.com/git/git/commit/b7cc53e92c806b73e14b03f60c17b7c29e52b4a4
+    TAG_SORT_MIN_VERSION = VersionInfo(2, 36, 1)
+    DIGITS_PATTERN = re.compile(r"([0-9]+)")
+
+    def _initialize(self, *args: Any, **kwargs: Any) -> None:
+        self._version: Optional[VersionInfo] = None
+        self._safe_directories: Set[str] = set()
 
     @property
     def command(self) -> str:
@@ -208,9 +227,6 @@ class Git(Tool):
     ) -> str:
         sort_arg = ""
         contains_arg = ""
-        # git tag sort was not added until 2.36.1 in 2015
-        # https://github.com/git/git/commit/b7cc53e92c806b73e14b03f60c17b7c29e52b4a4
-
         # git tag exposes various sort options, apply them if present
         # default is sort by version, ascending
         if sort_by:
@@ -219,26 +235,30 @@ class Git(Tool):
             # git tag allows you to filter by a commit id, apply it is present.
             contains_arg = f"--contains {contains}"
 
-        if self.get_version() >= VersionInfo.parse("2.36.1") or not sort_arg:
+        sort_locally = False
+        if not sort_arg or self.get_version() >= self.TAG_SORT_MIN_VERSION:
             git_cmd = f"--no-pager tag {sort_arg} {contains_arg}"
         else:
             # version is less than 2.36 and sorting is desired
-            # ask git to list tags and sort with sort -V
-            git_cmd = f" --no-pager tag -l {contains_arg} | sort -V"
+            # ask git to list tags and sort them like sort -V
+            git_cmd = f"--no-pager tag -l {contains_arg}"
+            sort_locally = True
 
         tags = self.run(
             git_cmd,
             cwd=cwd,
-            shell=True,
             expected_exit_code=0,
             expected_exit_code_failure_message=(
                 "git tag failed to fetch tags, "
                 "check sort and commit arguments are correct"
             ),
         ).stdout.splitlines()
+        if sort_locally:
+            tags.sort(key=self._version_sort_key)
         if filter:
-            filter_re = re.compile(filter)
-            tags = [x for x in tags if filter_re.search(x)]
+            filter_re = _compile_tag_filter(filter)
+            # the filter argument shadows the builtin one.
+            tags = list(builtins.filter(filter_re.search, tags))
 
         # build some nice error info for failure cases
         error_info = f"sortby:{sort_by} contains:{contains}"
@@ -255,9 +275,31 @@ class Git(Tool):
             return tags[0]
 
     def get_version(self) -> VersionInfo:
-        result = self.run("--version")
-        version_str = get_matched_str(result.stdout, self.VERSION_PATTERN)
-        return VersionInfo.parse(version_str)
+        # the git binary doesn't change on a node, so parse the version once.
+        if self._version is None:
+            result = self.run("--version")
+            matched = self.VERSION_PATTERN.search(result.stdout)
+            if not matched:
+                raise LisaException(f"failed to get git version: {result.stdout}")
+            self._version = VersionInfo(
+                int(matched.group("major")),
+                int(matched.group("minor")),
+                int(matched.group("patch")),
+            )
+        return self._version
+
+    def _version_sort_key(self, tag: str) -> List[Union[int, str]]:
+        # compare digit runs as numbers, so v5.10 is sorted after v5.9.
+        return [
+            int(part) if index % 2 else part
+            for index, part in enumerate(self.DIGITS_PATTERN.split(tag))
+        ]
 
     def _mark_safe(self, cwd: pathlib.PurePath) -> None:
+        # the global config is shared by all clones on the node, so a directory
+        # needs to be added only once.
+        directory = str(cwd)
+        if directory in self._safe_directories:
+            return
         self.run(f"config --global --add safe.directory {cwd}", cwd=cwd)
+        self._safe_directories.add(directory)
@@ -4,18 +4,18 @@
 import re
 from pathlib import PurePath, PurePosixPath
 from time import sleep
-from typing import TYPE_CHECKING, Any, List, Type
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple, Type
 
 from semver import VersionInfo
 
 from lisa.base_tools import Cat, Sed, Service, Wget
 from lisa.executable import Tool
 from lisa.operating_system import CBLMariner, Debian, Oracle, Posix, Redhat, Suse
-from lisa.tools import Find, Gcc
+from lisa.tools import Dmesg, Find, Gcc, Uname
 from lisa.tools.make import Make
 from lisa.tools.sysctl import Sysctl
 from lisa.tools.tar import Tar
-from lisa.util import LisaException, UnsupportedDistroException
+from lisa.util import LisaException, SkippedException, UnsupportedDistroException
 
 from .kernel_config import KernelConfig
 
@@ -23,6 +23,13 @@ if TYPE_CHECKING:
     from lisa.node import Node
 
 
+class DumpStateException(LisaException):
+    """
+    The output of checking the dump state is unexpected, while the node is still
+    connected.
+    """
+
+
 class Kexec(Tool):
     """
     kexec - directly boot into a new kernel
@@ -187,6 +194,15 @@ class KdumpBase(Tool):
 
     dump_path = "/var/crash"
 
+    # The last line printed by the dump state script. The commands run in a pty, so
+    # stderr is merged into stdout, and the line may follow an error message. PATH
+    # is the last field, so the path is kept even if it has spaces.
+    _dump_state_pattern = re.compile(
+        r"^STATE=(?P<state>complete|incomplete|none)"
+        r"(?: SIZE=(?P<size>\d*))?(?: PATH=(?P<path>.+?))?[ \t\r]*$",
+        re.M,
+    )
+
     @classmethod
     def create(cls, node: "Node", *args: Any, **kwargs: Any) -> Tool:
         # FreeBSD image doesn't support kdump since the kernel has no DDB option
@@ -216,6 +232,100 @@ class KdumpBase(Tool):
     def _install(self) -> bool:
         raise NotImplementedError()
 
+    def _initialize(self, *args: Any, **kwargs: Any) -> None:
+        # The kernel config and VMBus version don't change until the kernel changes,
+        # so the results of checking them are cached by the kernel version.
+        self._unsupported_reasons: Dict[str, str] = {}
+        self._auto_reserve_results: Dict[str, bool] = {}
+
+    def get_dump_state_script(self) -> str:
+        """
+        Returns the script to check the dump state in one remote call. It prints a
+        line like "STATE=incomplete SIZE=1024 PATH=/var/crash/vmcore-incomplete".
+        The incomplete file found in previous check is passed by the environment
+        variable "incomplete_file", so the script is built once for the dump path.
+        The output is parsed by parse_dump_state.
+        """
+        return (
+            'f="$incomplete_file"; '
+            'if [ -n "$f" ] && [ -f "$f" ]; then echo STATE=incomplete '
+            'SIZE=$(stat -c %s "$f" 2>/dev/null) PATH="$f"; exit 0; fi; '
+            f"f=$(find {self.dump_path} -type f -size +10M "
+            '\\( -name vmcore -o -name "dump.*" -o -name "vmcore.*" \\) '
+            "-print -quit 2>/dev/null); "
+            'if [ -n "$f" ]; then '
+            'echo STATE=complete SIZE=$(stat -c %s "$f" 2>/dev/null); exit 0; fi; '
+            f'f=$(find {self.dump_path} -name "*incomplete*" -print -quit '
+            "2>/dev/null); "
+            'if [ -n "$f" ]; then echo STATE=incomplete '
+            'SIZE=$(stat -c %s "$f" 2>/dev/null) PATH="$f"; '
+            "else echo STATE=none; fi"
+        )
+
+    @classmethod
+    def parse_dump_state(cls, output: str) -> Tuple[bool, str, int]:
+        """
+        Parses the output of the dump state script. Returns whether the dump file is
+        generated, the path of the incomplete dump file and its size.
+        """
+        matches = list(cls._dump_state_pattern.finditer(output))
+        if not matches:
+            raise DumpStateException(
+                f"unexpected output of checking dump state: '{output}'"
+            )
+        matched = matches[-1]
+        state = matched.group("state")
+        if state == "complete":
+            return True, "", 0
+        if state == "incomplete":
+            # SIZE is missing, if stat fails, such as the file is renamed after it's
+            # found. The next check finds it again.
+            if not matched.group("size") or not matched.group("path"):
+                return False, "", 0
+            return False, matched.group("path"), int(matched.group("size"))
+        return False, "", 0
+
+    def check_supported(self) -> None:
+        """
+        Checks if the kernel config and the negotiated VMBus version support kdump.
+        It raises SkippedException, if the VMBus version is too old.
+        """
+        kernel_version = self._get_kernel_version()
+        if kernel_version not in self._unsupported_reasons:
+            try:
+                self.check_required_kernel_config()
+                self._check_vmbus_version()
+                self._unsupported_reasons[kernel_version] = ""
+            except SkippedException as identifier:
+                self._unsupported_reasons[kernel_version] = str(identifier)
+        # A new exception is raised each time, so its traceback doesn't grow.
+        reason = self._unsupported_reasons[kernel_version]
+        if reason:
+            raise SkippedException(reason)
+
+    def is_auto_reserve_supported(self) -> bool:
+        """
+        Returns if the kernel reserves memory for crash kernel with crashkernel=auto.
+        """
+        kernel_version = self._get_kernel_version()
+        if kernel_version not in self._auto_reserve_results:
+            self._auto_reserve_results[kernel_version] = self.node.tools[
+                KernelConfig
+            ].is_built_in("CONFIG_KEXEC_AUTO_RESERVE")
+        return self._auto_reserve_results[kernel_version]
+
+    def _get_kernel_version(self) -> str:
+        return self.node.tools[Uname].get_linux_information().kernel_version_raw
+
+    def _check_vmbus_version(self) -> None:
+        vmbus_version = self.node.tools[Dmesg].get_vmbus_version()
+        if vmbus_version < "3.0.0":
+            raise SkippedException(
+                f"No negotiated VMBus version {vmbus_version}. "
+                "Kernel might be old or patches not included. "
+                "Full support for kdump is not present."
+            )
+
     def check_required_kernel_config(self) -> None:
         for config in self.required_kernel_config:
             if not self.node.tools[KernelConfig].is_built_in(config):
@@ -309,6 +419,15 @@ class KdumpBase(Tool):
         """
         return
 
+    def config_dump_threads(self, threads: int) -> None:
+        """
+        makedumpfile can copy the dump file with multiple threads, if the crash kernel
+        boots up with more than one cpu. It shortens the dump time a lot when the
+        system memory is large. The distro which supports it, need override this
+        method.
+        """
+        return
+
     def enable_kdump_service(self) -> None:
         """
         This method enables the kdump service.
@@ -365,10 +484,17 @@ class KdumpBase(Tool):
             else:
                 sleep(2)
 
-    def _check_crashkernel_in_cmdline(self, crashkernel_memory: str) -> None:
+    def is_crashkernel_in_cmdline(self, crashkernel_memory: str) -> bool:
+        """
+        Returns if the running kernel is booted with the crashkernel parameter. If so,
+        the kernel doesn't need rebooting to take effect of the crashkernel.
+        """
         cat = self.node.tools[Cat]
         result = cat.run("/proc/cmdline", force_run=True)
-        if f"crashkernel={crashkernel_memory}" not in result.stdout:
+        return f"crashkernel={crashkernel_memory}" in result.stdout.split()
+
+    def _check_crashkernel_in_cmdline(self, crashkernel_memory: str) -> None:
+        if not self.is_crashkernel_in_cmdline(crashkernel_memory):
             raise LisaException(
                 f"crashkernel={crashkernel_memory} boot parameter is not present in"
                 "kernel cmdline"
@@ -455,6 +581,35 @@ class KdumpRedhat(KdumpBase):
         )
         sed.append(f"path {self.dump_path}", kdump_conf, sudo=True)
 
+    def config_dump_threads(self, threads: int) -> None:
+        """
+        Boot the crash kernel with the cpus to run makedumpfile threads, and pass the
+        threads count to makedumpfile in the core collector.
+        """
+        sed = self.node.tools[Sed]
+        sed.substitute(
+            match_lines="^KDUMP_COMMANDLINE_APPEND",
+            regexp="nr_cpus=[0-9]*",
+            replacement=f"nr_cpus={threads}",
+            file="/etc/sysconfig/kdump",
+            sudo=True,
+        )
+        kdump_conf = "/etc/kdump.conf"
+        sed.substitute(
+            match_lines="^core_collector makedumpfile",
+            regexp=" --num-threads [0-9]*",
+            replacement="",
+            file=kdump_conf,
+            sudo=True,
+        )
+        sed.substitute(
+            match_lines="^core_collector makedumpfile",
+            regexp="$",
+            replacement=f" --num-threads {threads}",
+            file=kdump_conf,
+            sudo=True,
+        )
+
 
 class KdumpDebian(KdumpBase):
     @property
@@ -475,6 +630,51 @@ class KdumpDebian(KdumpBase):
     def _get_kdump_service_name(self) -> str:
         return "kdump-tools"
 
+    def config_dump_threads(self, threads: int) -> None:
+        """
+        Boot the crash kernel with the cpus to run makedumpfile threads, and pass the
+        threads count to makedumpfile. kdump-tools reads KDUMP_CMDLINE_APPEND and
+        MAKEDUMP_ARGS from its config file. They're commented out by default, so
+        they're added with the commented default values if missing.
+        """
+        config_file = "/etc/default/kdump-tools"
+        content = self.node.tools[Cat].read(config_file, force_run=True, sudo=True)
+        sed = self.node.tools[Sed]
+        for name, default_value, regexp, value in [
+            (
+                "KDUMP_CMDLINE_APPEND",
+                "reset_devices systemd.unit=kdump-tools-dump.service nr_cpus=1 "
+                "irqpoll nousb",
+                " *nr_cpus=[0-9]*",
+                f"nr_cpus={threads}",
+            ),
+            (
+                "MAKEDUMP_ARGS",
+                "-c -d 31",
+                " *--num-threads [0-9]*",
+                f"--num-threads {threads}",
+            ),
+        ]:
+            if not re.search(f"^{name}=", content, re.M):
+                commented = re.search(f'^# *{name}="(?P<value>.*)"', content, re.M)
+                if commented:
+                    default_value = commented.group("value")
+                sed.append(f'{name}="{default_value}"', config_file, sudo=True)
+            sed.substitute(
+                match_lines=f"^{name}=",
+                regexp=regexp,
+                replacement="",
+                file=config_file,
+                sudo=True,
+            )
+            sed.substitute(
+                match_lines=f"^{name}=",
+                regexp='"$',
+                replacement=f' {value}"',
+                file=config_file,
+                sudo=True,
+            )
+
 
 class KdumpSuse(KdumpBase):
     @property
@@ -486,6 +686,19 @@ class KdumpSuse(KdumpBase):
         self.node.os.install_packages("kdump")
         return self._check_exists()
 
+    def config_dump_threads(self, threads: int) -> None:
+        """
+        The crash kernel boots up with KDUMP_CPUS cpus, and kdump uses them to run
+        makedumpfile threads.
+        """
+        sed = self.node.tools[Sed]
+        sed.substitute(
+            regexp="^KDUMP_CPUS=.*",
+            replacement=f'KDUMP_CPUS="{threads}"',
+            file="/etc/sysconfig/kdump",
+            sudo=True,
+        )
+
 
 class KdumpCBLMariner(KdumpBase):
     @property
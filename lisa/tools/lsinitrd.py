@@ -6,15 +6,10 @@ from typing import cast
 
 from lisa.executable import Tool
 from lisa.operating_system import Posix
-from lisa.util import LisaException, find_patterns_in_lines, get_matched_str
+from lisa.util import LisaException
 
 
 class Lsinitrd(Tool):
-    _non_comment_pattern = re.compile(r"^\s*[^#\s].*$", re.MULTILINE)
-    _modules_dep_file_pattern = re.compile(
-        r".*\s(?P<PATH>[^\s]*\/modules\.dep)\s*$", re.MULTILINE
-    )
-
     @property
     def command(self) -> str:
         return "lsinitrd"
@@ -33,34 +28,28 @@ class Lsinitrd(Tool):
         1) Finds path of modules.dep in initrd
         2) Searches modules.dep for the module file name
         """
+        # Find the path of modules.dep from the listing and dump it in the same
+        # remote call. It exits with 2, if modules.dep isn't in the listing.
         result = self.run(
-            initrd_file_path,
+            f"{initrd_file_path} | "
+            f"awk '$NF ~ /\\/modules\\.dep$/ {{ print $NF; exit }}' | "
+            f'{{ read -r modules_dep || exit 2; {self.command} -f "$modules_dep" '
+            f"{initrd_file_path}; }}",
+            shell=True,
             sudo=True,
-            expected_exit_code=0,
-            expected_exit_code_failure_message=f"`lsinitrd {initrd_file_path}` failed.",
-        )
-
-        modules_dep_path = get_matched_str(
-            result.stdout, self._modules_dep_file_pattern
         )
-
-        if not modules_dep_path:
+        if result.exit_code == 2:
             raise LisaException(
                 f"[lsinitrd] modules.dep could not be found. "
                 f"Make sure the file is present in initrd image {initrd_file_path}."
             )
-
-        result = self.run(
-            f"-f {modules_dep_path} {initrd_file_path}",
-            sudo=True,
-            expected_exit_code=0,
-            expected_exit_code_failure_message=f"`lsinitrd -f /{modules_dep_path} "
-            f"{initrd_file_path}` failed.",
-        )
-        modules_required = find_patterns_in_lines(
-            result.stdout, [self._non_comment_pattern]
+        result.assert_exit_code(
+            message=f"`lsinitrd {initrd_file_path}` failed to dump modules.dep."
         )
 
-        return any(
-            module_file_name in requirement for requirement in modules_required[0]
+        # search non-comment lines for the module file name, it stops on the
+        # first match.
+        module_pattern = re.compile(
+            rf"^(?![ \t]*#).*{re.escape(module_file_name)}", re.MULTILINE
         )
+        return module_pattern.search(result.stdout) is not None
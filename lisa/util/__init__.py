@@ -507,6 +507,9 @@ def is_valid_url(url: str, raise_error: bool = True) -> bool:
 
 
 def filter_ansi_escape(content: str) -> str:
+    # all escapes start with ESC, skip the regex scan if there is none.
+    if "\x1b" not in content:
+        return content
     return __ansi_escape.sub("", content)
 
 
@@ -1,9 +1,11 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT license.
 import time
+from functools import partial
+from math import ceil
 from pathlib import Path, PurePosixPath
-from random import randint
-from typing import cast
+from random import Random
+from typing import Any, Dict, Optional, Tuple, cast
 
 from lisa import (
     LisaException,
@@ -22,10 +24,22 @@ from lisa import (
 from lisa.features import SerialConsole
 from lisa.operating_system import Redhat
 from lisa.sut_orchestrator.azure.tools import Waagent
-from lisa.tools import Dmesg, Echo, KdumpBase, KernelConfig, Lscpu, Stat
+from lisa.tools import KdumpBase, Lscpu
 from lisa.tools.free import Free
+from lisa.tools.kdump import DumpStateException
+from lisa.util.parallel import Task, TaskManager
 from lisa.util.perf_timer import create_timer
-from lisa.util.shell import try_connect
+
+_MEMORY_UNIT_TO_MB = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+
+
+def _mem_to_mb(memory: str) -> float:
+    # The memory is like "3.5G", "2048M" or "3T"
+    memory = memory.strip()
+    unit = memory[-1]
+    if unit not in _MEMORY_UNIT_TO_MB:
+        raise LisaException(f"unknown memory unit in '{memory}'")
+    return float(memory[:-1]) * _MEMORY_UNIT_TO_MB[unit]
 
 
 @TestSuiteMetadata(
@@ -46,12 +60,27 @@ from lisa.util.shell import try_connect
     """,
 )
 class KdumpCrash(TestSuite):
+    # Below are defaults. Test cases pass their own values to _kdump_test instead of
+    # changing them, so the test cases don't affect each other.
+    #
     # When with large system memory, the dump file can achieve more than 7G. It will
     # cost about 10min to copy dump file to disk for some distros, such as Ubuntu.
     # So we set the timeout time 800s to make sure the dump file is completed.
     timeout_of_dump_crash = 800
     trigger_kdump_cmd = "echo c > /proc/sysrq-trigger"
     crash_kernel = "512M"
+    # When the system memory is more than 1T, makedumpfile copies the dump file with
+    # multiple threads. Each cpu of crash kernel takes reserved memory, so the
+    # threads count is limited.
+    max_dump_threads = 8
+    # The intervals to retry connecting the VM and to check the dump file start
+    # small, and double up to the max, so a quick dump is found soon.
+    min_poll_interval = 0.25
+    max_poll_interval = 8.0
+    # The dump fails, if the incomplete file doesn't grow, or no dump file is found,
+    # in the seconds since the last progress. It doesn't depend on how many times
+    # it's checked, since a check may return early on other changes of dump path.
+    no_progress_timeout = 50
 
     @TestCaseMetadata(
         description="""
@@ -115,11 +144,15 @@ class KdumpCrash(TestSuite):
         priority=2,
     )
     def kdumpcrash_validate_on_random_cpu(
-        self, node: Node, log_path: Path, log: Logger
+        self, node: Node, log_path: Path, log: Logger, variables: Dict[str, Any]
     ) -> None:
         lscpu = node.tools[Lscpu]
         cpu_count = lscpu.get_core_count()
-        cpu_num = randint(0, cpu_count - 1)
+        # The cpu is picked by a seed, so the test case can be reproduced on the
+        # same node. Set the variable "kdump_random_cpu_seed" to pick another cpu.
+        seed = variables.get("kdump_random_cpu_seed", node.name)
+        cpu_num = Random(seed).randrange(cpu_count)
+        log.debug(f"trigger kdump on cpu {cpu_num}, picked by seed '{seed}'")
         self._trigger_kdump_on_specified_cpu(cpu_num, node, log_path, log)
 
     @TestCaseMetadata(
@@ -180,8 +213,7 @@ class KdumpCrash(TestSuite):
     def kdumpcrash_validate_auto_size(
         self, node: Node, log_path: Path, log: Logger
     ) -> None:
-        self.crash_kernel = "auto"
-        self._kdump_test(node, log_path, log)
+        self._kdump_test(node, log_path, log, crash_kernel="auto")
 
     @TestCaseMetadata(
         description="""
@@ -200,23 +232,11 @@ class KdumpCrash(TestSuite):
     def kdumpcrash_validate_large_memory_auto_size(
         self, node: Node, log_path: Path, log: Logger
     ) -> None:
-        self.crash_kernel = "auto"
-        self._kdump_test(node, log_path, log)
+        self._kdump_test(node, log_path, log, crash_kernel="auto")
 
-    def _check_supported(self, node: Node) -> None:
-        # Check the kernel config for kdump supported
+    def _check_supported(self, node: Node, crash_kernel: str) -> None:
         kdump = node.tools[KdumpBase]
-        kdump.check_required_kernel_config()
-
-        # Check the VMBus version for kdump supported
-        dmesg = node.tools[Dmesg]
-        vmbus_version = dmesg.get_vmbus_version()
-        if vmbus_version < "3.0.0":
-            raise SkippedException(
-                f"No negotiated VMBus version {vmbus_version}. "
-                "Kernel might be old or patches not included. "
-                "Full support for kdump is not present."
-            )
+        kdump.check_supported()
 
         # Below code aims to check the kernel config for "auto crashkernel" supported.
         # Redhat/Centos has this "auto crashkernel" feature. For version 7, it needs the
@@ -232,9 +252,7 @@ class KdumpCrash(TestSuite):
             and node.os.information.version >= "8.0.0-0"
             and node.os.information.version < "9.0.0-0"
         ):
-            if self.crash_kernel == "auto" and not node.tools[KernelConfig].is_built_in(
-                "CONFIG_KEXEC_AUTO_RESERVE"
-            ):
+            if crash_kernel == "auto" and not kdump.is_auto_reserve_supported():
                 raise SkippedException("crashkernel=auto doesn't work for the distro.")
 
     def _get_resource_disk_dump_path(self, node: Node) -> str:
@@ -255,9 +273,19 @@ class KdumpCrash(TestSuite):
         )
         return dump_path
 
-    def _kdump_test(self, node: Node, log_path: Path, log: Logger) -> None:
+    def _kdump_test(
+        self,
+        node: Node,
+        log_path: Path,
+        log: Logger,
+        crash_kernel: str = "",
+        trigger_kdump_cmd: str = "",
+    ) -> None:
+        crash_kernel = crash_kernel or self.crash_kernel
+        trigger_kdump_cmd = trigger_kdump_cmd or self.trigger_kdump_cmd
+        timeout_of_dump_crash = self.timeout_of_dump_crash
         try:
-            self._check_supported(node)
+            self._check_supported(node, crash_kernel)
         except UnsupportedDistroException as identifier:
             raise SkippedException(identifier)
 
@@ -272,55 +300,64 @@ class KdumpCrash(TestSuite):
         #         linux/7/html/kernel_administration_guide/kernel_crash_dump_guide
         # SUSE: https://www.suse.com/support/kb/doc/?id=000016171
         # We combine their configuration to set an empirical value
-        if (
-            "G" in total_memory
-            and float(total_memory.strip("G")) < 1
-            or "M" in total_memory
-            and float(total_memory.strip("M")) < 1024
-        ):
-            self.crash_kernel = "64M"
-        elif (
-            "G" in total_memory
-            and float(total_memory.strip("G")) < 2
-            or "M" in total_memory
-            and float(total_memory.strip("M")) < 2048
-        ):
-            self.crash_kernel = "128M"
-        elif "T" in total_memory and float(total_memory.strip("T")) > 1:
+        memory_mb = _mem_to_mb(total_memory)
+        if memory_mb < 1024:
+            crash_kernel = "64M"
+        elif memory_mb < 2048:
+            crash_kernel = "128M"
+        elif memory_mb > 1024 * 1024:
             # System memory is more than 1T, need to change the dump path
             # and set crashkernel=2G
             kdump.config_resource_disk_dump_path(
                 self._get_resource_disk_dump_path(node)
             )
-            self.crash_kernel = "2G"
-            self.timeout_of_dump_crash = 1200
-            if float(total_memory.strip("T")) > 6:
-                self.timeout_of_dump_crash = 2000
-
-        kdump.config_crashkernel_memory(self.crash_kernel)
-        kdump.enable_kdump_service()
-        # Cleaning up any previous crash dump files
-        node.execute(
+            crash_kernel = "2G"
+            kdump.config_dump_threads(
+                min(node.tools[Lscpu].get_core_count(), self.max_dump_threads)
+            )
+            timeout_of_dump_crash = 1200
+            if memory_mb > 6 * 1024 * 1024:
+                timeout_of_dump_crash = 2000
+
+        # Cleaning up any previous crash dump files. It runs in background while
+        # configuring crashkernel, which takes a while to update grub.
+        cleanup_process = node.execute_async(
             f"mkdir -p {kdump.dump_path} && rm -rf {kdump.dump_path}/*",
             shell=True,
             sudo=True,
         )
-
-        # Reboot system to make kdump take effect
-        node.reboot()
+        try:
+            kdump.config_crashkernel_memory(crash_kernel)
+            kdump.enable_kdump_service()
+        finally:
+            # Wait for the cleanup even if configuring fails, so it's not left
+            # running on the node.
+            cleanup_process.wait_result()
+
+        # Reboot system to make kdump take effect. If the kernel is already booted
+        # with the crashkernel, like a previous test case ran on the same node,
+        # restarting kdump service is enough to load the crash kernel.
+        if kdump.is_crashkernel_in_cmdline(crash_kernel):
+            kdump.restart_kdump_service()
+        else:
+            node.reboot()
 
         # Confirm that the kernel dump mechanism is enabled
-        kdump.check_crashkernel_loaded(self.crash_kernel)
-        # Activate the magic SysRq option
-        echo = node.tools[Echo]
-        echo.write_to_file("1", node.get_pure_path("/proc/sys/kernel/sysrq"), sudo=True)
-        node.execute("sync", shell=True, sudo=True)
-
+        kdump.check_crashkernel_loaded(crash_kernel)
+        # Activate the magic SysRq option and sync the disk in one command. The sync
+        # may take a while with much dirty data, so it uses the default timeout.
+        node.execute(
+            "echo 1 > /proc/sys/kernel/sysrq && sync",
+            shell=True,
+            sudo=True,
+            expected_exit_code=0,
+            expected_exit_code_failure_message="Fail to enable sysrq and sync disk",
+        )
         try:
             # Trigger kdump. After execute the trigger cmd, the VM will be disconnected
             # We set a timeout time 10.
             node.execute(
-                self.trigger_kdump_cmd,
+                trigger_kdump_cmd,
                 shell=True,
                 sudo=True,
                 timeout=10,
@@ -329,13 +366,152 @@ class KdumpCrash(TestSuite):
             log.debug(f"ignorable ssh exception: {identifier}")
 
         # Check if the vmcore file is generated after triggering a crash
-        self._check_kdump_result(node, log_path, log, kdump)
+        self._check_kdump_result(node, log_path, log, kdump, timeout_of_dump_crash)
 
         # We should clean up the vmcore file since the test is passed
         node.execute(f"rm -rf {kdump.dump_path}/*", shell=True, sudo=True)
 
+    def _get_dump_state(
+        self, node: Node, script: str, incomplete_file: str
+    ) -> Tuple[bool, str, int]:
+        """
+        Returns whether the dump file is generated, the path of the incomplete
+        dump file and its size. The incomplete file found in previous check is
+        probed directly, and it's searched again only if it's gone.
+        """
+        if incomplete_file:
+            # The stat by sftp is one message over the opened connection, and it
+            # doesn't start any process on the node. If the file is renamed after
+            # dump completes, or it's not accessible without sudo, use the script.
+            try:
+                return (
+                    False,
+                    incomplete_file,
+                    node.shell.stat(node.get_pure_path(incomplete_file)).st_size,
+                )
+            except OSError as identifier:
+                node.log.debug(f"fail to stat {incomplete_file}: {identifier}")
+        result = node.execute(
+            script,
+            shell=True,
+            sudo=True,
+            update_envs={"incomplete_file": incomplete_file},
+        )
+        return KdumpBase.parse_dump_state(result.stdout)
+
+    def _try_get_dump_state(
+        self, node: Node, script: str, incomplete_file: str, log: Logger
+    ) -> Optional[Tuple[bool, str, int]]:
+        """
+        Returns the dump state, or None if the node is disconnected. The unexpected
+        output of the check is raised, since the node is still connected.
+        """
+        try:
+            return self._get_dump_state(node, script, incomplete_file)
+        except DumpStateException:
+            raise
+        except Exception as identifier:
+            log.debug(
+                "Fail to execute command. It may be caused by the system kernel"
+                " reboot after dumping vmcore."
+                f"{identifier.__class__.__name__}: {identifier}. Retry..."
+            )
+            return None
+
+    def _wait_dump_path_change(
+        self, node: Node, dump_path: str, timeout: float, log: Logger
+    ) -> None:
+        """
+        Waits until a file is created, written or renamed under the dump path, or
+        timeout. The incomplete file is renamed to the dump file when dump completes,
+        so it's found without waiting the full interval. If inotifywait isn't
+        installed on the node, it sleeps on the node instead.
+        """
+        # inotifywait takes whole seconds, and 0 means waiting forever.
+        seconds = max(1, ceil(timeout))
+        try:
+            node.execute(
+                "if command -v inotifywait > /dev/null; then "
+                f"inotifywait -q -q -r -t {seconds} "
+                f"-e create,close_write,moved_to {dump_path}; "
+                f"else sleep {seconds}; fi",
+                shell=True,
+                sudo=True,
+                timeout=seconds + 60,
+            )
+        except Exception as identifier:
+            # The system may reboot after dumping vmcore. The next check handles it.
+            log.debug(
+                "Fail to wait for changes of dump path. "
+                f"{identifier.__class__.__name__}: {identifier}"
+            )
+
+    def _check_initramfs_in_background(
+        self,
+        serial_check: TaskManager[None],
+        serial_console: SerialConsole,
+        log_path: Path,
+        log: Logger,
+    ) -> None:
+        # has_idle_worker raises the exception of the finished check, if any.
+        if serial_check.has_idle_worker():
+            serial_check.submit_task(
+                Task(
+                    task_id=0,
+                    task=partial(
+                        serial_console.check_initramfs,
+                        saved_path=log_path,
+                        stage="after_trigger_crash",
+                        force_run=True,
+                    ),
+                    parent_logger=log,
+                )
+            )
+
     def _check_kdump_result(
-        self, node: Node, log_path: Path, log: Logger, kdump: KdumpBase
+        self,
+        node: Node,
+        log_path: Path,
+        log: Logger,
+        kdump: KdumpBase,
+        timeout_of_dump_crash: int,
+    ) -> None:
+        serial_console = node.features[SerialConsole]
+        # The serial log is downloaded and checked in background, so the retries
+        # of connecting aren't blocked by downloading. There is at most one check
+        # running, and the initramfs found by it is raised in a later retry. The
+        # pool is shut down on exit, so no thread is left after the test.
+        serial_check: TaskManager[None] = TaskManager(max_workers=1)
+        with serial_check:
+            try:
+                try:
+                    self._wait_dump_file(
+                        node,
+                        log_path,
+                        log,
+                        kdump,
+                        timeout_of_dump_crash,
+                        serial_check,
+                        serial_console,
+                    )
+                finally:
+                    # The background check is joined before the serial log is
+                    # downloaded below, so they don't write the same file at the
+                    # same time. The initramfs found by it is raised here.
+                    serial_check.wait_for_all_workers()
+            except LisaException:
+                serial_console.get_console_log(saved_path=log_path, force_run=True)
+                raise
+
+    def _wait_dump_file(
+        self,
+        node: Node,
+        log_path: Path,
+        log: Logger,
+        kdump: KdumpBase,
+        timeout_of_dump_crash: int,
+        serial_check: TaskManager[None],
+        serial_console: SerialConsole,
     ) -> None:
         # We use this function to check if the dump file is generated.
         # Steps:
@@ -354,98 +530,75 @@ class KdumpCrash(TestSuite):
         #    We need to catch the exception, and retry to connect the VM. Then follow
         #    the same steps to check.
         timer = create_timer()
-        remote_node = cast(RemoteNode, node)
+        connection_info = cast(RemoteNode, node)._connection_info
+        address = f"{connection_info.address}:{connection_info.port}"
         system_disconnected = True
-        serial_console = node.features[SerialConsole]
-        while system_disconnected and timer.elapsed(False) < self.timeout_of_dump_crash:
+        connect_interval = self.min_poll_interval
+        dump_state_script = kdump.get_dump_state_script()
+        while system_disconnected and timer.elapsed(False) < timeout_of_dump_crash:
             try:
-                try_connect(remote_node._connection_info)
+                # After trigger kdump, the VM will reboot. The connection of node is
+                # reopened, which waits for the SSH port ready. The opened
+                # connection is used by the checks below, so it doesn't need to
+                # connect with another client first.
+                node.close()
+                node.execute("true")
             except Exception as identifier:
                 log.debug(
-                    "Fail to connect SSH "
-                    f"{remote_node._connection_info.address}:"
-                    f"{remote_node._connection_info.port}. "
+                    f"Fail to connect SSH {address}. "
                     f"{identifier.__class__.__name__}: {identifier}. Retry..."
                 )
-                serial_console.check_initramfs(
-                    saved_path=log_path, stage="after_trigger_crash", force_run=True
+                self._check_initramfs_in_background(
+                    serial_check, serial_console, log_path, log
                 )
                 system_disconnected = True
+                time.sleep(connect_interval)
+                connect_interval = min(connect_interval * 2, self.max_poll_interval)
                 continue
 
             # If there is no exception, then the system is connected
             system_disconnected = False
 
-            # After trigger kdump, the VM will reboot. We need to close the node
-            node.close()
             saved_dumpfile_size = 0
-            max_retries = 10
-            retries = 0
+            progress_timer = create_timer()
+            poll_interval = self.min_poll_interval
+            incomplete_file = ""
+            incomplete_file_size = 0
             # Check in this loop until the dump file is generated or incomplete file
             # doesn't grow or timeout
             while True:
-                try:
-                    # The exit code of this command is always 0. Check the stdout
-                    result = node.execute(
-                        f"find {kdump.dump_path} -type f -size +10M "
-                        "\\( -name vmcore -o -name dump.* -o -name vmcore.* \\) "
-                        "-exec ls -lh {} \\;",
-                        shell=True,
-                        sudo=True,
-                    )
-                    if result.stdout:
-                        break
-                    # Check if has dump incomplete file
-                    result = node.execute(
-                        f"find {kdump.dump_path} -name '*incomplete*'",
-                        shell=True,
-                        sudo=True,
-                    )
-                    if result.stdout:
-                        incomplete_file = result.stdout
-                        stat = node.tools[Stat]
-                        incomplete_file_size = stat.get_total_size(incomplete_file)
-                except Exception as identifier:
-                    log.debug(
-                        "Fail to execute command. It may be caused by the system kernel"
-                        " reboot after dumping vmcore."
-                        f"{identifier.__class__.__name__}: {identifier}. Retry..."
-                    )
+                dump_state = self._try_get_dump_state(
+                    node, dump_state_script, incomplete_file, log
+                )
+                if not dump_state:
                     system_disconnected = True
                     break
-                if result.stdout:
-                    if incomplete_file_size > saved_dumpfile_size:
-                        saved_dumpfile_size = incomplete_file_size
-                        retries = 0
-                    else:
-                        retries = retries + 1
-                        if retries >= max_retries:
-                            serial_console.get_console_log(
-                                saved_path=log_path, force_run=True
-                            )
-                            raise LisaException(
-                                "The vmcore file is incomplete with file size"
-                                f" {round(incomplete_file_size/1024/1024, 2)}MB"
-                            )
-                else:
-                    retries = retries + 1
-                    if retries >= max_retries:
-                        serial_console.get_console_log(
-                            saved_path=log_path, force_run=True
-                        )
+                dump_completed, incomplete_file, size = dump_state
+                if dump_completed:
+                    break
+                if incomplete_file:
+                    incomplete_file_size = size
+                if incomplete_file_size > saved_dumpfile_size:
+                    saved_dumpfile_size = incomplete_file_size
+                    progress_timer = create_timer()
+                elif progress_timer.elapsed(False) >= self.no_progress_timeout:
+                    if incomplete_file:
                         raise LisaException(
-                            "No vmcore or vmcore-incomplete is found under "
-                            f"{kdump.dump_path} with file size greater than 10M."
+                            "The vmcore file is incomplete with file size"
+                            f" {round(incomplete_file_size/1024/1024, 2)}MB"
                         )
-                if timer.elapsed(False) > self.timeout_of_dump_crash:
-                    serial_console.get_console_log(saved_path=log_path, force_run=True)
+                    raise LisaException(
+                        "No vmcore or vmcore-incomplete is found under "
+                        f"{kdump.dump_path} with file size greater than 10M."
+                    )
+                if timer.elapsed(False) > timeout_of_dump_crash:
                     raise LisaException(
                         "Timeout to dump vmcore file. The size of vmcore-incomplete is"
                         f" {round(incomplete_file_size/1024/1024, 2)}MB"
                     )
-                time.sleep(5)
+                self._wait_dump_path_change(node, kdump.dump_path, poll_interval, log)
+                poll_interval = min(poll_interval * 2, self.max_poll_interval)
         if system_disconnected:
-            serial_console.get_console_log(saved_path=log_path, force_run=True)
             raise LisaException("Timeout to connect the VM after triggering kdump.")
 
     def _trigger_kdump_on_specified_cpu(
@@ -454,10 +607,12 @@ class KdumpCrash(TestSuite):
         lscpu = node.tools[Lscpu]
         cpu_count = lscpu.get_core_count()
         if cpu_count > cpu_num:
-            self.trigger_kdump_cmd = (
-                f"taskset -c {cpu_num} echo c > /proc/sysrq-trigger"
+            self._kdump_test(
+                node,
+                log_path,
+                log,
+                trigger_kdump_cmd=f"taskset -c {cpu_num} echo c > /proc/sysrq-trigger",
             )
-            self._kdump_test(node, log_path, log)
         else:
             raise SkippedException(
                 "The cpu count can't meet the test case's requirement. "
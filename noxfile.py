@@ -3,38 +3,81 @@ Nox configuration file
 See https://nox.thea.codes/en/stable/config.html
 """
 
+import hashlib
 import platform
 import sys
 from pathlib import Path
 
 import nox
-import toml
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
 
 CURRENT_PYTHON = sys.executable or f"{sys.version_info.major}.{sys.version_info.minor}"
 ON_WINDOWS = platform.system() == "Windows"
 
-CONFIG = toml.load("pyproject.toml")
-DEPENDENCIES = CONFIG["project"]["dependencies"]
-OPTIONAL_DEPENDENCIES = CONFIG["project"]["optional-dependencies"]
-NOX_DEPENDENCIES = ("nox", "toml")
+with open("pyproject.toml", "rb") as config_file:
+    CONFIG = tomllib.load(config_file)
+DEPENDENCIES = tuple(CONFIG["project"]["dependencies"])
+OPTIONAL_DEPENDENCIES = {
+    name: tuple(dependencies)
+    for name, dependencies in CONFIG["project"]["optional-dependencies"].items()
+}
+BUILD_DEPENDENCIES = tuple(CONFIG["build-system"]["requires"])
+NOX_DEPENDENCIES = ("nox", "tomli; python_version < '3.11'")
+DEV_VENV_PATH = ".venv"
 
 
 # Global options
 nox.options.stop_on_first_error = False
 nox.options.error_on_missing_interpreters = False
+# The existing virtual environment is reused, and pip isn't run if the packages
+# to install and pyproject.toml are unchanged (see _install). So unpinned tools,
+# such as black, isort, pylint and virtualenv, aren't upgraded until it runs with
+# --no-reuse-existing-virtualenvs.
+nox.options.reuse_existing_virtualenvs = True
 
 # Require support for tags
 nox.needs_version = ">=2022.8.7"
 
 
+def _install(session: nox.Session, *args: str) -> None:
+    """
+    Install packages, unless the same packages are installed already in the reused
+    virtual environment. The packages are identified by the arguments and the
+    content of pyproject.toml.
+    """
+    fingerprint = hashlib.sha256(
+        repr(sorted(args)).encode() + Path("pyproject.toml").read_bytes()
+    ).hexdigest()
+    fingerprint_file = Path(session.virtualenv.location) / ".install-fingerprint"
+    if fingerprint_file.exists() and fingerprint_file.read_text() == fingerprint:
+        session.log("Packages are installed already, skip installing.")
+        return
+
+    session.install(*args)
+    fingerprint_file.write_text(fingerprint)
+
+
+def _get_dev_venv_executable(name: str) -> str:
+    if ON_WINDOWS:
+        return str(Path(DEV_VENV_PATH).resolve() / "Scripts" / f"{name}.exe")
+    return str(Path(DEV_VENV_PATH).resolve() / "bin" / name)
+
+
 # --- Testing ---
 
 
 @nox.session(python=CURRENT_PYTHON, tags=["test", "all"])
 def test(session: nox.Session) -> None:
     """Run tests"""
-    session.install(
-        *DEPENDENCIES, *OPTIONAL_DEPENDENCIES["azure"], *OPTIONAL_DEPENDENCIES["test"]
+    _install(
+        session,
+        *DEPENDENCIES,
+        *OPTIONAL_DEPENDENCIES["azure"],
+        *OPTIONAL_DEPENDENCIES["test"],
     )
     session.run("python", "-m", "unittest", "discover")
 
@@ -42,14 +85,25 @@ def test(session: nox.Session) -> None:
 @nox.session(python=CURRENT_PYTHON, tags=["test", "all"])
 def example(session: nox.Session) -> None:
     """Run example"""
-    session.install(".")
+    # The virtual environment of dev session has an editable install of LISA, so
+    # the current code can run there without building LISA again.
+    dev_lisa = _get_dev_venv_executable("lisa")
+    if Path(dev_lisa).exists():
+        session.run(dev_lisa, "--debug", external=True)
+        return
+
+    # Build in the session environment, instead of an isolated one, which
+    # installs the build requirements on each run.
+    _install(session, *BUILD_DEPENDENCIES)
+    session.install("--no-build-isolation", ".")
     session.run("lisa", "--debug")
 
 
 @nox.session(python=CURRENT_PYTHON, tags=["all"])
 def coverage(session: nox.Session) -> None:
     """Check test coverage"""
-    session.install(
+    _install(
+        session,
         *DEPENDENCIES,
         *OPTIONAL_DEPENDENCIES["azure"],
         *OPTIONAL_DEPENDENCIES["test"],
@@ -68,14 +122,14 @@ def coverage(session: nox.Session) -> None:
 @nox.session(python=CURRENT_PYTHON, tags=["format", "all"])
 def black(session: nox.Session) -> None:
     """Run black"""
-    session.install("black")
+    _install(session, "black")
     session.run("black", ".")
 
 
 @nox.session(python=CURRENT_PYTHON, tags=["format", "all"])
 def isort(session: nox.Session) -> None:
     """Run isort"""
-    session.install("isort")
+    _install(session, "isort")
     session.run("isort", ".")
 
 
@@ -85,7 +139,8 @@ def isort(session: nox.Session) -> None:
 @nox.session(python=CURRENT_PYTHON, tags=["lint", "all"])
 def flake8(session: nox.Session) -> None:
     """Run flake8"""
-    session.install(
+    _install(
+        session,
         *OPTIONAL_DEPENDENCIES["flake8"],
     )
     session.run("flake8")
@@ -94,7 +149,8 @@ def flake8(session: nox.Session) -> None:
 @nox.session(python=CURRENT_PYTHON, tags=["lint", "all"])
 def pylint(session: nox.Session) -> None:
     """Run pylint"""
-    session.install(
+    _install(
+        session,
         *DEPENDENCIES,
         *NOX_DEPENDENCIES,
         *OPTIONAL_DEPENDENCIES["aws"],
@@ -103,8 +159,12 @@ def pylint(session: nox.Session) -> None:
         *OPTIONAL_DEPENDENCIES["typing"],
         "pylint",
     )
+    # Use all cpus. The checks which aren't accurate in parallel, like duplicate-code
+    # and cyclic-import, are disabled in pylintrc.
     session.run(
         "pylint",
+        "--jobs",
+        "0",
         "lisa",
         "microsoft",
         "examples",
@@ -121,7 +181,8 @@ def pylint(session: nox.Session) -> None:
 @nox.session(python=CURRENT_PYTHON, tags=["typing", "all"])
 def mypy(session: nox.Session) -> None:
     """Run mypy"""
-    session.install(
+    _install(
+        session,
         *DEPENDENCIES,
         *OPTIONAL_DEPENDENCIES["azure"],
         *OPTIONAL_DEPENDENCIES["typing"],
@@ -140,7 +201,8 @@ def mypy(session: nox.Session) -> None:
 @nox.session(python=CURRENT_PYTHON, tags=["all"])
 def docs(session: nox.Session) -> None:
     """Build docs"""
-    session.install(
+    _install(
+        session,
         *DEPENDENCIES,
         *OPTIONAL_DEPENDENCIES["docs"],
         *OPTIONAL_DEPENDENCIES["azure"],
@@ -172,15 +234,11 @@ def dev(session: nox.Session) -> None:
         extras = "azure,libvirt"
 
     # Determine paths
-    venv_path = ".venv"
-
-    if ON_WINDOWS:
-        venv_python = str(Path(venv_path).resolve() / "Scripts" / "python.exe")
-    else:
-        venv_python = str(Path(venv_path).resolve() / "bin" / "python")
+    venv_path = DEV_VENV_PATH
+    venv_python = _get_dev_venv_executable("python")
 
     # Install virtualenv, it's used to create the final virtual environment
-    session.install("virtualenv")
+    _install(session, "virtualenv")
 
     # Create virtual environment
     session.run(
@@ -0,0 +1,87 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from unittest.case import TestCase
+
+from lisa.sut_orchestrator.azure.common import AzureNodeSchema, AzureVmMarketplaceSchema
+from lisa.util import LisaException
+
+
+class AzureNodeSchemaTestCase(TestCase):
+    def test_marketplace_from_str(self) -> None:
+        node = AzureNodeSchema(
+            marketplace_raw=" Canonical:UbuntuServer  18.04-LTS:Latest "
+        )
+        self.assertEqual(
+            AzureVmMarketplaceSchema(
+                "canonical", "ubuntuserver", "18.04-lts", "latest"
+            ),
+            node.marketplace,
+        )
+        self.assertEqual(
+            {
+                "publisher": "canonical",
+                "offer": "ubuntuserver",
+                "sku": "18.04-lts",
+                "version": "latest",
+            },
+            node.marketplace_raw,
+        )
+        self.assertEqual(
+            "canonical ubuntuserver 18.04-lts latest", node.get_image_name()
+        )
+
+    def test_marketplace_from_dict(self) -> None:
+        node = AzureNodeSchema(
+            marketplace_raw={
+                "publisher": "Canonical",
+                "offer": "UbuntuServer ",
+                "sku": "18.04-LTS",
+                "version": "latest",
+            }
+        )
+        self.assertEqual(
+            AzureVmMarketplaceSchema(
+                "canonical", "ubuntuserver", "18.04-lts", "latest"
+            ),
+            node.marketplace,
+        )
+        self.assertEqual(
+            {
+                "publisher": "canonical",
+                "offer": "ubuntuserver",
+                "sku": "18.04-lts",
+                "version": "latest",
+            },
+            node.marketplace_raw,
+        )
+
+        # a misspelled key isn't dropped silently, or the default image is used.
+        node = AzureNodeSchema(
+            marketplace_raw={
+                "publisher": "Canonical",
+                "offer": "UbuntuServer",
+                "skus": "18.04-LTS",
+                "version": "latest",
+            }
+        )
+        with self.assertRaises(LisaException) as context:
+            _ = node.marketplace
+        self.assertIn("skus", str(context.exception))
+
+    def test_marketplace_invalid_str(self) -> None:
+        node = AzureNodeSchema(marketplace_raw="canonical ubuntuserver")
+        with self.assertRaises(LisaException):
+            _ = node.marketplace
+
+    def test_marketplace_setter(self) -> None:
+        node = AzureNodeSchema(marketplace_raw="a b c d")
+        self.assertEqual(AzureVmMarketplaceSchema("a", "b", "c", "d"), node.marketplace)
+
+        node.marketplace = AzureVmMarketplaceSchema("e", "f", "g", "h")
+        self.assertEqual(AzureVmMarketplaceSchema("e", "f", "g", "h"), node.marketplace)
+        self.assertEqual("e f g h", node.get_image_name())
+
+        node.marketplace = None
+        self.assertIsNone(node.marketplace)
+        self.assertIsNone(node.marketplace_raw)
@@ -0,0 +1,46 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from unittest.case import TestCase
+
+from lisa.tools.kdump import DumpStateException, KdumpBase
+
+
+class DumpStateTestCase(TestCase):
+    def test_parse_complete(self) -> None:
+        self.assertEqual(
+            (True, "", 0), KdumpBase.parse_dump_state("STATE=complete SIZE=1048576")
+        )
+
+    def test_parse_incomplete(self) -> None:
+        self.assertEqual(
+            (False, "/var/crash/a b/vmcore-incomplete", 1024),
+            KdumpBase.parse_dump_state(
+                "STATE=incomplete SIZE=1024 PATH=/var/crash/a b/vmcore-incomplete\r\n"
+            ),
+        )
+
+    def test_parse_none(self) -> None:
+        self.assertEqual((False, "", 0), KdumpBase.parse_dump_state("STATE=none"))
+
+    def test_parse_merged_stderr(self) -> None:
+        # stderr is merged into stdout by the pty. If the incomplete file is renamed
+        # between find and stat, the error comes before the state line.
+        output = (
+            "stat: cannot statx '/var/crash/vmcore-incomplete': "
+            "No such file or directory\r\n"
+            "STATE=incomplete SIZE= PATH=/var/crash/vmcore-incomplete\r\n"
+        )
+        self.assertEqual((False, "", 0), KdumpBase.parse_dump_state(output))
+
+        output = (
+            "find: '/var/crash/127.0.0.1-2023': No such file or directory\n"
+            "STATE=complete SIZE=1048576"
+        )
+        self.assertEqual((True, "", 0), KdumpBase.parse_dump_state(output))
+
+    def test_parse_unexpected(self) -> None:
+        with self.assertRaises(DumpStateException):
+            KdumpBase.parse_dump_state("sh: 1: Syntax error")
+        with self.assertRaises(DumpStateException):
+            KdumpBase.parse_dump_state("")